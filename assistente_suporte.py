@@ -1,14 +1,40 @@
 import streamlit as st
+import asyncio
 import os
 import glob
+import hashlib
+import json
+import logging
+import multiprocessing
+import pickle
+import queue
+import subprocess
+import tempfile
+import threading
+import uuid
+from collections import OrderedDict, deque
+from operator import itemgetter
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
+import faiss
+import numpy as np
 from dotenv import load_dotenv
 
 # Importações do LangChain
-from langchain_community.document_loaders import DirectoryLoader
+from langchain_community.docstore.in_memory import InMemoryDocstore
 from langchain_community.vectorstores import FAISS
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain_community.vectorstores.utils import DistanceStrategy
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import PromptTemplate
 from langchain_google_genai import GoogleGenerativeAIEmbeddings, GoogleGenerativeAI
-from langchain.chains import RetrievalQA
+
+from ingestao import LOADERS, carregar_arquivo
+
+# Os loaders de documentos, o diskcache e os splitters só são importados
+# dentro das funções de ingestão: quando o índice já está salvo em disco,
+# essas dependências (pymupdf, unstructured etc.) nem chegam a ser carregadas.
 
 # Carrega variáveis de ambiente do arquivo .env
 load_dotenv()
@@ -18,8 +44,453 @@ st.set_page_config(page_title="Assistente de Suporte TI", page_icon="🤖")
 st.title("🤖 Assistente de Suporte de TI")
 st.caption("Eu sou um assistente baseado nos documentos da base de conhecimento.")
 
+
+# Executada uma única vez por processo (e não a cada reexecução do script):
+# usa os núcleos disponíveis (deixando um livre) na inserção e busca do FAISS
+# e registra as opções de compilação, que mostram se o build em uso tem os
+# kernels AVX2/AVX-512.
+@st.cache_resource(show_spinner=False)
+def configurar_faiss():
+    faiss.omp_set_num_threads(max(1, (os.cpu_count() or 2) - 1))
+    logger = logging.getLogger("assistente_suporte")
+    logger.setLevel(logging.INFO)
+    logger.addHandler(logging.StreamHandler())
+    logger.info("FAISS compilado com: %s", faiss.get_compile_options())
+
+
+configurar_faiss()
+
 # --- LÓGICA DE CACHE PARA CARREGAR RECURSOS PESADOS ---
 
+DIRETORIO_CACHE_FAISS = "./.faiss_cache"
+# Entra no nome do diretório do índice salvo: deve mudar sempre que o formato
+# do índice ou a forma de ler e dividir os documentos mudar, para que índices
+# antigos não sejam reaproveitados.
+VERSAO_INDICE = "v2-hnsw-fp16"
+DIRETORIO_CACHE_EMBEDDINGS = "./.embed_cache"
+# Imagens .png só entram na base com ENABLE_OCR=1 (requer o tesseract instalado)
+OCR_HABILITADO = os.environ.get("ENABLE_OCR") == "1"
+TAMANHO_LOTE_EMBEDDINGS = 96
+# Número de tarefas que geram embeddings ao mesmo tempo (e portanto máximo de
+# requisições simultâneas), para respeitar o limite da API do Gemini
+MAX_REQUISICOES_EMBEDDINGS = 8
+# Limite das filas entre as etapas do pipeline, para limitar o uso de memória
+TAMANHO_FILA = 128
+FIM = None  # Sentinela que indica o fim de uma fila
+# Abaixo desse número de vetores a busca exaustiva já é tão rápida quanto o
+# grafo HNSW, que só compensa o custo de construção em bases maiores.
+MIN_VETORES_HNSW = 1000
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = 64
+TAMANHO_CHUNK = 1000
+SOBREPOSICAO_CHUNK = 200
+# Só as últimas mensagens da conversa são mantidas e exibidas a cada
+# reexecução do script
+MAX_MENSAGENS_HISTORICO = 50
+# Cada trecho recuperado é cortado nesse tamanho antes de ir para o prompt
+TAMANHO_MAXIMO_TRECHO = 500
+PROMPT = PromptTemplate.from_template(
+    "Use os trechos da base de conhecimento abaixo para responder à pergunta. "
+    "Se a resposta não estiver nos trechos, diga que não sabe.\n\n"
+    "Trechos:\n{context}\n\n"
+    "Pergunta: {query}\n"
+    "Resposta:"
+)
+# Vetores normalizados + produto interno equivalem a similaridade por cosseno.
+# O LangChain normaliza também os vetores das perguntas com normalize_L2.
+OPCOES_VECTOR_STORE = {
+    "normalize_L2": True,
+    "distance_strategy": DistanceStrategy.MAX_INNER_PRODUCT,
+}
+
+
+class EmbeddingsComCache(Embeddings):
+    # Guarda em memória o embedding das perguntas já feitas, poupando uma
+    # chamada à API a cada consulta repetida ao retriever.
+
+    def __init__(self, embeddings, tamanho_cache=4096):
+        self.embeddings = embeddings
+        self._embed_query = lru_cache(maxsize=tamanho_cache)(
+            embeddings.embed_query)
+
+    def embed_documents(self, texts):
+        return self.embeddings.embed_documents(texts)
+
+    async def aembed_documents(self, texts):
+        return await self.embeddings.aembed_documents(texts)
+
+    def embed_query(self, text):
+        # Devolve uma cópia para que o valor guardado não seja alterado
+        return list(self._embed_query(text))
+
+
+def calcular_hash_base(diretorio):
+    # Gera uma "impressão digital" da base a partir de (caminho, mtime, tamanho)
+    # de cada arquivo. Qualquer arquivo novo, removido ou alterado muda o hash.
+    arquivos = [
+        p for p in glob.glob(os.path.join(diretorio, "**", "*"), recursive=True)
+        if os.path.isfile(p)
+    ]
+    assinatura = sorted(
+        (p, os.path.getmtime(p), os.path.getsize(p)) for p in arquivos)
+    return hashlib.sha256(repr(assinatura).encode()).hexdigest()[:16]
+
+
+def filtrar_arquivos(caminhos):
+    # Descarta arquivos vazios e cópias (inclusive links simbólicos) antes da
+    # leitura. Duas cópias são identificadas pelo tamanho e pelo hash dos
+    # primeiros 64 KB, sem precisar ler o arquivo inteiro.
+    # Arquivos que não podem ser lidos (links quebrados, sem permissão) vão
+    # para a lista de erros, como os que falham na leitura.
+    vistos = set()
+    mantidos = []
+    erros = []
+    for caminho in caminhos:
+        try:
+            tamanho = os.path.getsize(caminho)
+            if tamanho == 0:
+                continue
+            with open(caminho, "rb") as f:
+                chave = (tamanho, hashlib.sha1(f.read(65536)).digest())
+        except OSError as e:
+            nome_arquivo = os.path.basename(caminho)
+            erros.append(f"Arquivo: '{nome_arquivo}' - Erro: {e}")
+            continue
+        if chave in vistos:
+            continue
+        vistos.add(chave)
+        mantidos.append(caminho)
+    return mantidos, erros
+
+
+def listar_arquivos(diretorio):
+    arquivos = []
+    # O glob do Python não expande chaves ("*.{txt,pdf}"), então cada
+    # extensão é buscada separadamente.
+    for ext in LOADERS:
+        arquivos.extend(glob.glob(
+            os.path.join(diretorio, "**", f"*.{ext}"), recursive=True))
+    return filtrar_arquivos(sorted(arquivos))
+
+
+def listar_imagens(diretorio):
+    return filtrar_arquivos(sorted(glob.glob(
+        os.path.join(diretorio, "**", "*.png"), recursive=True)))
+
+
+def ler_imagens_ocr(imagens):
+    # Uma única chamada ao tesseract para todas as imagens: ele recebe um
+    # arquivo com a lista de caminhos e separa o texto de cada imagem com \f.
+    with tempfile.TemporaryDirectory() as diretorio_temp:
+        lista = os.path.join(diretorio_temp, "imagens.txt")
+        with open(lista, "w", encoding="utf-8") as f:
+            f.write("\n".join(os.path.abspath(p) for p in imagens))
+        saida = os.path.join(diretorio_temp, "saida")
+        try:
+            subprocess.run(["tesseract", lista, saida, "-l", "por"],
+                           check=True, capture_output=True)
+        except OSError as e:
+            return [], [f"OCR das imagens .png - Erro: {e}"]
+        except subprocess.CalledProcessError as e:
+            # O tesseract para na primeira imagem ilegível; a mensagem dele
+            # (stderr) indica qual arquivo falhou.
+            detalhe = e.stderr.decode(errors="replace").strip() or str(e)
+            return [], [f"OCR das imagens .png - Erro: {detalhe}"]
+        with open(saida + ".txt", encoding="utf-8") as f:
+            # Cada página termina com \f, então o último item fica vazio
+            paginas = f.read().split("\f")[:-1]
+
+    # Só dá para associar cada texto à sua imagem se houver uma página por
+    # imagem
+    if len(paginas) != len(imagens):
+        return [], [
+            f"OCR das imagens .png - Erro: o tesseract devolveu {len(paginas)} "
+            f"páginas para {len(imagens)} imagens"]
+
+    documentos = [
+        Document(page_content=texto, metadata={"source": caminho})
+        for caminho, texto in zip(imagens, paginas)
+        if texto.strip()
+    ]
+    return documentos, []
+
+
+def obter_fast_chunker():
+    # O Chonkie é opcional: se não estiver instalado, ou se for uma versão sem
+    # o FastChunker (anterior à 1.6), usamos o splitter do LangChain. O
+    # resultado é obtido uma única vez por ingestão e usado tanto na chave do
+    # índice salvo quanto na divisão, já que os dois geram chunks diferentes.
+    try:
+        from chonkie import FastChunker
+    except ImportError:
+        return None
+    return FastChunker
+
+
+def criar_divisor(fast_chunker):
+    # Devolve a função que divide documentos em chunks. O divisor é criado uma
+    # única vez por ingestão e reaproveitado para todos os documentos.
+    if fast_chunker is not None:
+        # Divisão por bytes acelerada por SIMD, bem mais rápida em bases grandes.
+        # O FastChunker não tem sobreposição entre chunks e o chunk_size dele
+        # conta bytes UTF-8, não caracteres: com o Chonkie os chunks ficam
+        # diferentes dos gerados pelo splitter do LangChain.
+        chunker = fast_chunker(chunk_size=TAMANHO_CHUNK)
+
+        def dividir_texto(texto):
+            return [c.text for c in chunker.chunk(texto)]
+    else:
+        from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+        text_splitter = RecursiveCharacterTextSplitter(
+            chunk_size=TAMANHO_CHUNK, chunk_overlap=SOBREPOSICAO_CHUNK,
+            separators=["\n\n", "\n", ". ", " ", ""])
+        dividir_texto = text_splitter.split_text
+
+    # Divide só o texto e monta os Documents diretamente, sem o
+    # split_documents, que recria cada Document internamente.
+    def dividir_documentos(documentos):
+        return [
+            Document(page_content=trecho, metadata=doc.metadata)
+            for doc in documentos
+            for trecho in dividir_texto(doc.page_content)
+        ]
+    return dividir_documentos
+
+
+async def gerar_embeddings(embeddings, cache, textos):
+    # Cada chunk é identificado pelo hash do seu texto: só os chunks novos ou
+    # alterados vão para a API, o restante vem do cache em disco.
+    chaves = [hashlib.sha256(t.encode()).digest() for t in textos]
+    vetores = [cache.get(chave) for chave in chaves]
+    faltantes = [i for i, v in enumerate(vetores) if v is None]
+    if faltantes:
+        novos = await embeddings.aembed_documents(
+            [textos[i] for i in faltantes])
+        for i, vetor in zip(faltantes, novos):
+            vetores[i] = np.asarray(vetor, dtype="float32").tobytes()
+            cache.set(chaves[i], vetores[i])
+    return [np.frombuffer(v, dtype="float32") for v in vetores]
+
+
+def processar_base(arquivos, imagens, embeddings, fast_chunker):
+    import diskcache
+
+    # Pipeline em três etapas ligadas por filas limitadas: leitura dos arquivos
+    # -> divisão em chunks -> embeddings. As etapas rodam ao mesmo tempo e cada
+    # documento pode ser liberado da memória assim que é dividido.
+    fila_documentos = queue.Queue(maxsize=TAMANHO_FILA)
+    fila_lotes = queue.Queue(maxsize=TAMANHO_FILA)
+    arquivos_com_erro = []
+    num_documentos = 0
+    # Sinaliza para todas as etapas que o pipeline deve parar (erro em alguma
+    # delas), para que nenhuma fique bloqueada para sempre numa fila cheia.
+    cancelado = threading.Event()
+    falhas = []
+
+    def colocar(fila, item):
+        # Espera por espaço na fila, desistindo se o pipeline for cancelado
+        while not cancelado.is_set():
+            try:
+                fila.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def retirar(fila):
+        # Espera pelo próximo item; em caso de cancelamento, devolve FIM
+        while not cancelado.is_set():
+            try:
+                return fila.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        return FIM
+
+    def executar_etapa(etapa, fila_saida):
+        # Se a etapa falhar, cancela o pipeline e guarda a exceção para
+        # relançá-la na thread principal
+        try:
+            etapa()
+        except Exception as e:
+            falhas.append(e)
+            cancelado.set()
+        finally:
+            colocar(fila_saida, FIM)
+
+    def etapa_leitura():
+        nonlocal num_documentos
+        # Cada arquivo é carregado individualmente, em processos paralelos
+        # (a leitura de PDF/DOCX/PPTX é pesada em CPU), para identificar
+        # exatamente qual arquivo pode estar com problema.
+        # O pool é criado a partir de uma thread do servidor do Streamlit, que
+        # tem várias threads: com "fork" os processos filhos poderiam herdar
+        # locks travados. O "spawn" inicia processos limpos, que importam só o
+        # módulo ingestao.
+        num_processos = max(1, (os.cpu_count() or 2) - 1)
+        executor = ProcessPoolExecutor(
+            max_workers=num_processos,
+            mp_context=multiprocessing.get_context("spawn"))
+        try:
+            for caminho, docs, erro in executor.map(
+                    carregar_arquivo, arquivos, chunksize=4):
+                if erro is not None:
+                    # Se falhar, guardamos o nome do arquivo e o erro
+                    nome_arquivo = os.path.basename(caminho)
+                    arquivos_com_erro.append(
+                        f"Arquivo: '{nome_arquivo}' - Erro: {erro}")
+                    continue
+                # Conta arquivos, não Documents: PDFs geram um por página
+                num_documentos += 1
+                for doc in docs:
+                    if not colocar(fila_documentos, doc):
+                        return
+        finally:
+            # Se a leitura foi interrompida, descarta os arquivos pendentes
+            executor.shutdown(cancel_futures=True)
+
+        if imagens:
+            docs, erros = ler_imagens_ocr(imagens)
+            arquivos_com_erro.extend(erros)
+            # Aqui há um Document por imagem
+            num_documentos += len(docs)
+            for doc in docs:
+                if not colocar(fila_documentos, doc):
+                    return
+
+    def etapa_divisao():
+        dividir_documentos = criar_divisor(fast_chunker)
+        lote = []
+        while (doc := retirar(fila_documentos)) is not FIM:
+            lote.extend(dividir_documentos([doc]))
+            while len(lote) >= TAMANHO_LOTE_EMBEDDINGS:
+                if not colocar(fila_lotes, lote[:TAMANHO_LOTE_EMBEDDINGS]):
+                    return
+                lote = lote[TAMANHO_LOTE_EMBEDDINGS:]
+        if lote:
+            colocar(fila_lotes, lote)
+
+    threads = [
+        threading.Thread(target=executar_etapa,
+                         args=(etapa_leitura, fila_documentos), daemon=True),
+        threading.Thread(target=executar_etapa,
+                         args=(etapa_divisao, fila_lotes), daemon=True),
+    ]
+    for thread in threads:
+        thread.start()
+
+    # Etapa de embeddings: um número fixo de tarefas assíncronas consome os
+    # lotes conforme ficam prontos, para que o tempo de ida e volta de várias
+    # requisições se sobreponha. Cada tarefa só retira um novo lote da fila
+    # depois de terminar o anterior, então a fila limitada continua limitando
+    # a memória.
+    textos, metadados, resultados = [], [], []
+
+    async def etapa_embeddings(cache):
+        async def trabalhador():
+            while (lote := await asyncio.to_thread(retirar, fila_lotes)) is not FIM:
+                # Reserva a posição do lote antes do await, para manter os
+                # vetores na mesma ordem dos textos
+                posicao = len(resultados)
+                resultados.append(None)
+                textos_lote = [d.page_content for d in lote]
+                textos.extend(textos_lote)
+                metadados.extend(d.metadata for d in lote)
+                resultados[posicao] = await gerar_embeddings(
+                    embeddings, cache, textos_lote)
+            # Devolve o FIM para que os demais trabalhadores também terminem
+            colocar(fila_lotes, FIM)
+
+        try:
+            await asyncio.gather(*(
+                trabalhador() for _ in range(MAX_REQUISICOES_EMBEDDINGS)))
+        except BaseException:
+            # Libera os trabalhadores que estão esperando na fila
+            cancelado.set()
+            raise
+
+    try:
+        with diskcache.Cache(DIRETORIO_CACHE_EMBEDDINGS) as cache:
+            asyncio.run(etapa_embeddings(cache))
+    except BaseException:
+        cancelado.set()
+        raise
+    finally:
+        for thread in threads:
+            thread.join()
+    if falhas:
+        raise falhas[0]
+    vetores = [v for resultado in resultados for v in resultado]
+    return textos, vetores, metadados, num_documentos, arquivos_com_erro
+
+
+def construir_indice(vetores):
+    xb = np.asarray(vetores, dtype="float32")
+    faiss.normalize_L2(xb)
+    d = xb.shape[1]
+    # Em ambos os casos os vetores ficam guardados em float16: metade da
+    # memória e da banda lida a cada consulta, sem perda relevante de recall.
+    if len(xb) < MIN_VETORES_HNSW:
+        index = faiss.IndexScalarQuantizer(
+            d, faiss.ScalarQuantizer.QT_fp16, faiss.METRIC_INNER_PRODUCT)
+    else:
+        # Grafo HNSW: a busca percorre O(log N) vizinhos em vez de varrer a
+        # base inteira.
+        index = faiss.IndexHNSWSQ(
+            d, faiss.ScalarQuantizer.QT_fp16, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    index.train(xb)
+    index.add(xb)
+    return index
+
+
+def montar_vector_store(embeddings, textos, vetores, metadados):
+    index = construir_indice(vetores)
+    ids = [str(uuid.uuid4()) for _ in textos]
+    docstore = InMemoryDocstore({
+        id_: Document(page_content=texto, metadata=meta)
+        for id_, texto, meta in zip(ids, textos, metadados)
+    })
+    return FAISS(
+        embedding_function=embeddings,
+        index=index,
+        docstore=docstore,
+        index_to_docstore_id=dict(enumerate(ids)),
+        **OPCOES_VECTOR_STORE,
+    )
+
+
+def carregar_vector_store(diretorio, embeddings):
+    # Lê o que o FAISS.save_local gravou (index.faiss e index.pkl), abrindo o
+    # índice somente leitura. O IO_FLAG_MMAP_IFC mapeia em memória os vetores
+    # dos índices baseados em códigos (IndexScalarQuantizer e o armazenamento
+    # do IndexHNSWSQ), em vez de copiá-los para a RAM. Versões do faiss sem
+    # essa opção leem o índice inteiro para a memória.
+    flag_mmap = getattr(faiss, "IO_FLAG_MMAP_IFC", 0)
+    index = faiss.read_index(
+        os.path.join(diretorio, "index.faiss"),
+        flag_mmap | faiss.IO_FLAG_READ_ONLY)
+    with open(os.path.join(diretorio, "index.pkl"), "rb") as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+    return FAISS(
+        embedding_function=embeddings,
+        index=index,
+        docstore=docstore,
+        index_to_docstore_id=index_to_docstore_id,
+        **OPCOES_VECTOR_STORE,
+    )
+
+
+def formatar_contexto(documentos):
+    # Monta um contexto enxuto para o prompt: remove trechos repetidos e corta
+    # cada um, mantendo a ordem em que o retriever os devolveu.
+    unicos = {}
+    for doc in documentos:
+        unicos.setdefault(hashlib.md5(doc.page_content.encode()).digest(), doc)
+    return "\n\n".join(
+        doc.page_content[:TAMANHO_MAXIMO_TRECHO] for doc in unicos.values())
+
 
 @st.cache_resource
 def carregar_recursos():
@@ -38,30 +509,43 @@ def carregar_recursos():
         return None, None
 
     with st.spinner("Analisando e carregando a base de conhecimento..."):
-        # Define o loader para encontrar os arquivos
-        directory_loader = DirectoryLoader(
-            DIRETORIO_BASE_CONHECIMENTO,
-            glob="**/*.{txt,pdf,docx,md,sql,csv,doc,png,pptx,xlsx}",
-            show_progress=True,
-            use_multithreading=True,
-        )
+        embeddings = EmbeddingsComCache(
+            GoogleGenerativeAIEmbeddings(model="models/embedding-001"))
 
-        # === MELHORIA: Carregamento robusto de documentos ===
-        # Em vez de carregar tudo de uma vez, carregamos um por um
-        # para identificar exatamente qual arquivo pode estar com problema.
-        documentos = []
-        arquivos_com_erro = []
-
-        # Usamos lazy_load() que prepara os arquivos sem carregar na memória ainda
-        for loader in directory_loader.lazy_load():
-            try:
-                # Tentamos carregar o conteúdo do arquivo
-                documentos.extend(loader)
-            except Exception as e:
-                # Se falhar, guardamos o nome do arquivo e o erro
-                nome_arquivo = os.path.basename(loader.file_path)
-                arquivos_com_erro.append(
-                    f"Arquivo: '{nome_arquivo}' - Erro: {e}")
+        # Reaproveita o índice salvo em disco se a base não mudou desde a última
+        # execução, evitando ler os arquivos e gerar novamente os embeddings.
+        fast_chunker = obter_fast_chunker()
+        nome_divisor = "chonkie" if fast_chunker is not None else "langchain"
+        hash_base = calcular_hash_base(DIRETORIO_BASE_CONHECIMENTO)
+        if OCR_HABILITADO:
+            hash_base += "-ocr"
+        diretorio_indice = os.path.join(
+            DIRETORIO_CACHE_FAISS,
+            f"{VERSAO_INDICE}-{nome_divisor}-{hash_base}")
+        arquivo_info = os.path.join(diretorio_indice, "info.json")
+        if os.path.isfile(arquivo_info):
+            vector_store = carregar_vector_store(diretorio_indice, embeddings)
+            with open(arquivo_info, encoding="utf-8") as f:
+                info = json.load(f)
+            num_documentos = info["num_documentos"]
+            arquivos_com_erro = info["arquivos_com_erro"]
+        else:
+            # === MELHORIA: Carregamento robusto de documentos ===
+            arquivos, erros_arquivos = listar_arquivos(
+                DIRETORIO_BASE_CONHECIMENTO)
+            imagens, erros_imagens = listar_imagens(
+                DIRETORIO_BASE_CONHECIMENTO) if OCR_HABILITADO else ([], [])
+            textos, vetores, metadados, num_documentos, erros_leitura = \
+                processar_base(arquivos, imagens, embeddings, fast_chunker)
+            arquivos_com_erro = erros_arquivos + erros_imagens + erros_leitura
+            vector_store = None
+            if textos:
+                vector_store = montar_vector_store(
+                    embeddings, textos, vetores, metadados)
+                vector_store.save_local(diretorio_indice)
+                with open(arquivo_info, "w", encoding="utf-8") as f:
+                    json.dump({"num_documentos": num_documentos,
+                               "arquivos_com_erro": arquivos_com_erro}, f)
 
         # Mostra avisos na tela para cada arquivo que falhou
         if arquivos_com_erro:
@@ -69,43 +553,93 @@ def carregar_recursos():
             for erro in arquivos_com_erro:
                 st.write(erro)
 
-        if not documentos:
+        if vector_store is None:
             st.error(
                 "Nenhum documento válido foi lido com sucesso na base de conhecimento.")
             return None, None
 
-        # Quebra dos textos em pedaços
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000, chunk_overlap=200)
-        textos_divididos = text_splitter.split_documents(documentos)
+        # Parâmetro de busca do HNSW, ajustado também em índices carregados
+        if isinstance(vector_store.index, faiss.IndexHNSW):
+            vector_store.index.hnsw.efSearch = HNSW_EF_SEARCH
 
-        # Criação dos embeddings e da vector store
-        embeddings = GoogleGenerativeAIEmbeddings(model="models/embedding-001")
-        vector_store = FAISS.from_documents(textos_divididos, embeddings)
+        # Uma única busca traz 20 candidatos, que são reordenados por MMR
+        # (relevância x diversidade) para escolher os 4 trechos enviados ao
+        # modelo. Os vetores já estão normalizados, então a conta de cosseno
+        # do MMR é consistente com o índice.
+        retriever = vector_store.as_retriever(
+            search_type="mmr",
+            search_kwargs={"k": 4, "fetch_k": 20, "lambda_mult": 0.5},
+        )
 
         # Criação da cadeia de Perguntas e Respostas
         llm = GoogleGenerativeAI(
             model="gemini-1.5-flash-latest", temperature=0.3)
-        qa_chain = RetrievalQA.from_chain_type(
-            llm=llm,
-            chain_type="stuff",
-            retriever=vector_store.as_retriever(),
-            return_source_documents=False
+        qa_chain = (
+            {
+                "context": itemgetter("query") | retriever | formatar_contexto,
+                "query": itemgetter("query"),
+            }
+            | PROMPT
+            | llm
+            | StrOutputParser()
         )
-        return qa_chain, len(documentos)
+        return qa_chain, num_documentos
+
+
+def normalizar_pergunta(pergunta):
+    # Ignora diferenças de maiúsculas e espaços entre perguntas repetidas
+    return " ".join(pergunta.lower().split())
+
+
+class CacheRespostas:
+    # Cache LRU das respostas por pergunta normalizada. Perguntas repetidas
+    # (comuns em suporte de TI) são respondidas sem nova busca nem nova
+    # chamada ao modelo.
+
+    def __init__(self, tamanho_maximo=512):
+        self.tamanho_maximo = tamanho_maximo
+        self.respostas = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, pergunta):
+        with self.lock:
+            resposta = self.respostas.get(pergunta)
+            if resposta is not None:
+                self.respostas.move_to_end(pergunta)
+            return resposta
+
+    def set(self, pergunta, resposta):
+        with self.lock:
+            self.respostas[pergunta] = resposta
+            self.respostas.move_to_end(pergunta)
+            if len(self.respostas) > self.tamanho_maximo:
+                self.respostas.popitem(last=False)
+
+
+# O st.cache_resource mantém uma única instância, compartilhada entre as
+# sessões e preservada nas reexecuções do script.
+@st.cache_resource
+def obter_cache_respostas():
+    return CacheRespostas()
 
 
 # --- LÓGICA PRINCIPAL DA APLICAÇÃO ---
 qa_chain, num_docs = carregar_recursos()
 
-if qa_chain:
+if qa_chain is not None:
     st.success(
         f"Base de conhecimento carregada! {num_docs} documentos foram processados com sucesso.")
 
+    cache_respostas = obter_cache_respostas()
+    ignorar_cache = st.sidebar.checkbox(
+        "Ignorar cache de respostas",
+        help="Gera uma nova resposta mesmo para perguntas já feitas.")
+
     # Inicializa o histórico da conversa na memória da sessão
     if "messages" not in st.session_state:
-        st.session_state.messages = [
-            {"role": "assistant", "content": "Olá! Como posso te ajudar hoje?"}]
+        st.session_state.messages = deque(
+            [{"role": "assistant", "content": "Olá! Como posso te ajudar hoje?"}],
+            maxlen=MAX_MENSAGENS_HISTORICO)
 
     # Exibe as mensagens do histórico
     for message in st.session_state.messages:
@@ -118,15 +652,21 @@ if qa_chain:
         with st.chat_message("user"):
             st.markdown(prompt)
 
-        # Gera e exibe a resposta do assistente
+        # Gera e exibe a resposta do assistente. A resposta é exibida conforme
+        # é gerada, em vez de esperar o texto completo.
         with st.chat_message("assistant"):
-            with st.spinner("Pensando..."):
+            pergunta = normalizar_pergunta(prompt)
+            resposta = None if ignorar_cache else cache_respostas.get(pergunta)
+            if resposta is not None:
+                st.markdown(resposta)
+            else:
                 try:
-                    resultado = qa_chain.invoke({"query": prompt})
-                    resposta = resultado["result"]
+                    resposta = st.write_stream(
+                        qa_chain.stream({"query": pergunta}))
+                    cache_respostas.set(pergunta, resposta)
                 except Exception as e:
                     resposta = f"Desculpe, ocorreu um erro ao processar sua pergunta: {e}"
-            st.markdown(resposta)
+                    st.markdown(resposta)
 
         st.session_state.messages.append(
             {"role": "assistant", "content": resposta})
@@ -0,0 +1,37 @@
+import os
+
+# Este módulo não importa o Streamlit nem o script do app: os processos do
+# pool de leitura importam só ele. Se a função de leitura ficasse no script,
+# o multiprocessing (com o método "spawn", padrão no Windows e no macOS)
+# executaria o app inteiro de novo em cada processo.
+
+# Loader (de langchain_community.document_loaders) e argumentos usados para
+# cada extensão: formatos de texto puro são lidos diretamente, sem passar pelo
+# Unstructured, que é bem mais lento, e PDFs usam o PyMuPDF (biblioteca em C).
+LOADERS = {
+    "txt": ("TextLoader", {"autodetect_encoding": True}),
+    "md": ("TextLoader", {"autodetect_encoding": True}),
+    "sql": ("TextLoader", {"autodetect_encoding": True}),
+    # O CSVLoader gera um Document por linha; lido como texto, o arquivo é
+    # dividido em chunks normalmente.
+    "csv": ("TextLoader", {"autodetect_encoding": True}),
+    "pdf": ("PyMuPDFLoader", {}),
+    "doc": ("UnstructuredWordDocumentLoader", {}),
+    "docx": ("UnstructuredWordDocumentLoader", {}),
+    "pptx": ("UnstructuredPowerPointLoader", {}),
+    "xlsx": ("UnstructuredExcelLoader", {}),
+}
+
+
+def carregar_arquivo(caminho):
+    # Executada em um processo separado: devolve o erro em vez de lançá-lo,
+    # para não derrubar o pool.
+    try:
+        from langchain_community import document_loaders
+
+        ext = os.path.splitext(caminho)[1][1:].lower()
+        nome_loader, opcoes = LOADERS[ext]
+        loader = getattr(document_loaders, nome_loader)(caminho, **opcoes)
+        return caminho, loader.load(), None
+    except Exception as e:
+        return caminho, [], e